@@ -4,15 +4,13 @@ import json
 import time
 import random
 import argparse
-import configparser
-from queue import Queue
+from queue import Queue, Empty
 from threading import Thread
 from collections import namedtuple
 from datetime import date, datetime, timedelta, timezone
 
-import requests
-from bs4 import BeautifulSoup
-from requests_oauthlib import OAuth1
+# requests, bs4 and requests_oauthlib are imported where they are first used
+# so that short-lived invocations only pay for the subsystems they touch.
 
 
 TWITTER_DATE_FORMAT = '%a %b %d %H:%M:%S %z %Y'
@@ -39,6 +37,8 @@ class REST_API(object):
             return 'https://api.twitter.com/1.1/statuses/retweets/:id.json'
 
     def set_session(self):
+        import requests
+        from requests_oauthlib import OAuth1
         s = requests.Session()
         s.auth = OAuth1(**self.keys)
         return s
@@ -67,8 +67,11 @@ class AdvancedSearch():
     """
     _sentinel = object()
 
-    def __init__(self, keys):
+    def __init__(self, keys, api=None, wrapper=None):
         self.keys = keys
+        self.api = api
+        self.wrapper = wrapper or AdvancedSearchWrapper()
+        self.error = None
         self.TWEET_IDS = Queue()
         self.TWEETS = Queue()
 
@@ -82,15 +85,23 @@ class AdvancedSearch():
             if tweet is AdvancedSearch._sentinel:
                 break
             yield(tweet)
+        # re-raise failures of the worker threads in the caller
+        if self.error is not None:
+            raise self.error
 
     def stop(self):
+        self.wrapper.stop()
         self.TWEETS.put(AdvancedSearch._sentinel)
 
     def gen_tweet_ids(self, payload):
         """A thread that generates tweet ids for a historic search"""
-        for tweet in AdvancedSearchWrapper().run(payload,):
-            self.TWEET_IDS.put(tweet['tweet_id'])
-        self.TWEET_IDS.put(AdvancedSearch._sentinel)
+        try:
+            for tweet in self.wrapper.run(payload,):
+                self.TWEET_IDS.put(tweet['tweet_id'])
+        except Exception as e:
+            self.error = e
+        finally:
+            self.TWEET_IDS.put(AdvancedSearch._sentinel)
 
     def gen_chunks(self, n=100):
         ids = []
@@ -106,16 +117,22 @@ class AdvancedSearch():
 
     def gen_raw_tweets(self):
         """A thread that given tweet id generates raw json tweets"""
-        api = REST_API(keys=self.keys, end_point='status_lookup')
-        for tweet_ids in self.gen_chunks():
-            if tweet_ids == []: break
-            payload = {'id': ','.join(tweet_ids),
-                       'tweet_mode': 'extended'}
-            raw_tweets = [t for t in api.post(payload=payload) if 'created_at' in t]
-            for tweet in sorted(raw_tweets,
-                key=lambda t: datetime.strptime(t['created_at'], TWITTER_DATE_FORMAT)):
-                self.TWEETS.put(tweet)
-        self.TWEETS.put(AdvancedSearch._sentinel)
+        try:
+            api = self.api or REST_API(keys=self.keys, end_point='status_lookup')
+            for tweet_ids in self.gen_chunks():
+                if tweet_ids == []: break
+                payload = {'id': ','.join(tweet_ids),
+                           'tweet_mode': 'extended'}
+                raw_tweets = [t for t in api.post(payload=payload) if 'created_at' in t]
+                for tweet in sorted(raw_tweets,
+                    key=lambda t: datetime.strptime(t['created_at'], TWITTER_DATE_FORMAT)):
+                    self.TWEETS.put(tweet)
+        except Exception as e:
+            # keep the first failure, and stop scraping ids nobody will look up
+            self.error = self.error or e
+            self.wrapper.stop()
+        finally:
+            self.TWEETS.put(AdvancedSearch._sentinel)
 
 
 class AdvancedSearchWrapper():
@@ -141,9 +158,11 @@ class AdvancedSearchWrapper():
     def __init__(self):
         self.session = self.set_session()
         self.status = 'run'
+        self.heartbeat = None
         self.TWEETS = Queue()
 
     def set_session(self):
+        import requests
         user_agents = ['Opera/9.80 (X11; Linux x86_64; U; fr) Presto/2.9.168 Version/11.50',
                 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)',
                 'Mozilla/5.0 (X11; Linux i686; rv:10.0) Gecko/20100101 Firefox/10.0',
@@ -154,6 +173,7 @@ class AdvancedSearchWrapper():
         return s
 
     def run(self, payload):
+        self.status = 'run'
         payload = check_payload(payload)
         if payload.get('daily'):
             stream = self.daily_search(payload)
@@ -178,7 +198,7 @@ class AdvancedSearchWrapper():
         self.url = 'https://twitter.com/search'
         payload = self.gen_payload(payload)
         print(payload)
-        r = self.session.get(self.url, params=payload)
+        r = self.fetch(payload)
         print(r.url)
         self.url = 'https://twitter.com/i/search/timeline'
         all_tweets = []
@@ -200,13 +220,20 @@ class AdvancedSearchWrapper():
                 break
             payload['max_position'] = min_position
             time.sleep(random.random())
-            r = self.session.get(self.url, params=payload)
+            r = self.fetch(payload)
 
         # sorted in chronological order
         for tweet in sorted(all_tweets,
                 key=lambda t: datetime.strptime(t.created_at, TWITTER_DATE_FORMAT)):
             yield (tweet._asdict())
 
+    def fetch(self, payload):
+        """gets a result page, signalling progress to heartbeat if set"""
+        r = self.session.get(self.url, params=payload)
+        if self.heartbeat:
+            self.heartbeat()
+        return r
+
     def _split_by_comma_or_space(self, s):
         if ',' in s:
             return [h.strip() for h in s.split(',')]
@@ -349,6 +376,7 @@ class AdvancedSearchWrapper():
         early_exit = False
         nof_tweets_all = 0
         nof_tweets_early = 0
+        from bs4 import BeautifulSoup
         s = BeautifulSoup(t, 'html.parser')
         for e in s.findAll('div', {'class' : 'original-tweet'}):
             created_at  = e.find('span', {'class':'_timestamp'})
@@ -428,6 +456,7 @@ class AdvancedSearchWrapper():
 
 def name2keys(key='default', fin='credentials.cfg'):
     """convert name to twitter keys from credentials file"""
+    import configparser
     config = configparser.ConfigParser()
     config.read(fin)
     mapping = {'consumer_key'        : 'client_key',
@@ -473,6 +502,7 @@ def check_payload(args):
     """
     global STRICTLY_SINCE
     global STRICTLY_UNTIL
+    STRICTLY_SINCE = STRICTLY_UNTIL = None
     since = args.get('since')
     if since:
         since, STRICTLY_SINCE = parse_date(since)
@@ -486,15 +516,183 @@ def check_payload(args):
     return args
 
 
-def read_payload(args):
+def read_payload(args, check=True):
     # script input mode: from command line vs file
     if args.mode == 'cmd':
         payload = vars(args)
     else:
         payload = read_config(args.fin)
+    if not check:
+        return payload
     return check_payload(payload)
 
 
+def timed_run(stream, wrapper, payload, timeout, on_page=None):
+    """Runs stream in a worker thread and yields its tweets.
+    Raises TimeoutError if neither a tweet nor a result page fetched by
+    wrapper arrives within timeout seconds, so that a stuck job cannot
+    block the daemon forever while long --chronological or --daily jobs,
+    which may fetch many pages before yielding a tweet, keep running.
+    on_page, if given, is called for every fetched page.
+    """
+    results = Queue()
+    wrapper.heartbeat = lambda: results.put(('page', None))
+
+    def work():
+        try:
+            for tweet in stream.run(payload):
+                results.put(('tweet', tweet))
+            results.put(('done', None))
+        except Exception as e:
+            results.put(('error', e))
+
+    Thread(target=work, daemon=True).start()
+    try:
+        while True:
+            try:
+                kind, value = results.get(timeout=timeout)
+            except Empty:
+                raise TimeoutError('no progress within {} seconds'.format(timeout))
+            if kind == 'page':
+                if on_page:
+                    on_page()
+                continue
+            if kind == 'done':
+                return
+            if kind == 'error':
+                raise value
+            yield(value)
+    finally:
+        wrapper.heartbeat = None
+        stream.stop()
+
+
+def make_server(address, timeout=600):
+    """Search daemon listening on unix socket address.
+    Each connection sends one json job {'payload': ..., 'raw': ..., 'key': ...}
+    and gets back one json message per line: {'tweet': ...} for every tweet,
+    {'page': true} for every fetched result page, then either {'done': true}
+    or {'error': ...}. Sessions are kept across jobs so that process start-up
+    and TLS handshakes are not paid per job. Jobs run one at a time; further
+    connections wait until the running job finishes or times out.
+    The socket is only accessible to the daemon's user, since jobs run with
+    the daemon's Twitter credentials.
+    """
+    import stat
+    import socket
+    import socketserver
+    state = {'wrapper': AdvancedSearchWrapper(), 'apis': {}}
+
+    class JobHandler(socketserver.StreamRequestHandler):
+        def send(self, message):
+            self.wfile.write('{}\n'.format(json.dumps(message)).encode('utf-8'))
+
+        def handle(self):
+            finished = False
+            key = None
+            try:
+                job = json.loads(self.rfile.readline().decode('utf-8'))
+                payload = job['payload']
+                wrapper = state['wrapper']
+                if job.get('raw'):
+                    key = job.get('key', 'default')
+                    apis = state['apis']
+                    if key not in apis:
+                        apis[key] = REST_API(keys=name2keys(key),
+                                end_point='status_lookup')
+                    stream = AdvancedSearch(apis[key].keys, api=apis[key],
+                            wrapper=wrapper)
+                else:
+                    stream = wrapper
+                sys.stderr.write('JOB: {}\n'.format(payload))
+                heartbeat = lambda: self.send({'page': True})
+                for tweet in timed_run(stream, wrapper, payload, timeout, heartbeat):
+                    self.send({'tweet': tweet})
+                finished = True
+                self.send({'done': True})
+            except BrokenPipeError:
+                pass # client went away
+            except Exception as e:
+                sys.stderr.write('JOB failed: {}\n'.format(e))
+                try:
+                    self.send({'error': str(e)})
+                except OSError:
+                    pass # client went away
+            finally:
+                # an unfinished job may still be using the shared sessions
+                if not finished:
+                    state['wrapper'] = AdvancedSearchWrapper()
+                    state['apis'].pop(key, None)
+
+    if os.path.exists(address):
+        if not stat.S_ISSOCK(os.stat(address).st_mode):
+            raise FileExistsError('{} exists and is not a socket'.format(address))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(address)
+            except ConnectionRefusedError:
+                os.remove(address) # stale socket of a dead daemon
+            else:
+                raise FileExistsError('a daemon is already serving on {}'.format(address))
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(address, JobHandler)
+    finally:
+        os.umask(umask)
+    return server
+
+
+def serve(address, timeout=600):
+    """Runs the search daemon on unix socket address until interrupted"""
+    server = make_server(address, timeout)
+    sys.stderr.write('SERVING on {}\n'.format(address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.remove(address)
+        except FileNotFoundError:
+            pass
+
+
+def submit(address, payload, raw=False, key='default', timeout=None):
+    """Sends a search job to the daemon at unix socket address
+    and yields the resulting tweets. Raises TimeoutError if the daemon
+    sends nothing for timeout seconds, e.g. while an earlier job runs.
+    """
+    import socket
+    job = json.dumps({'payload': payload, 'raw': raw, 'key': key})
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+            sock.sendall('{}\n'.format(job).encode('utf-8'))
+            with sock.makefile('rb') as f:
+                for line in f:
+                    message = json.loads(line.decode('utf-8'))
+                    if 'tweet' in message:
+                        yield(message['tweet'])
+                    elif 'error' in message:
+                        raise RuntimeError(message['error'])
+                    elif message.get('done'):
+                        return
+                    # {'page': true} only shows the job is progressing
+        except socket.timeout:
+            raise TimeoutError('no reply from daemon within {} seconds'.format(timeout))
+    raise RuntimeError('daemon closed the connection before the job finished')
+
+
+def positive_int(value):
+    """argparse type for a whole number greater than zero"""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError('{} is not a positive number'.format(value))
+    return number
+
+
 def read_args():
     """ expose functionalities in https://twitter.com/search-advanced
     as much as possible
@@ -503,6 +701,8 @@ def read_args():
 
     parser.add_argument('-all',  '--allwords', help='all of these words')
     parser.add_argument('-any',  '--anywords', help='any of these words')
+    parser.add_argument('--connect', help='send the search to a running daemon',
+            action='store_true')
     parser.add_argument('-c', '--chronological',  help='in chronological order by time',
             action='store_true')
     parser.add_argument('-d', '--daily', help='daily search from past to recent.',
@@ -528,7 +728,15 @@ def read_args():
             action='store_true')
     parser.add_argument('-rt', '--retweets', help='include retweets',
             choices=[True, False])
+    parser.add_argument('--serve', help='run as a daemon accepting search jobs',
+            action='store_true')
+    parser.add_argument('--socket', help='unix socket of the daemon',
+            default='advancedsearch.sock')
     parser.add_argument('-s',  '--since', help='since date yyyy-mm-dd[-HH:MM]')
+    parser.add_argument('--timeout', help='with --serve, seconds a job may go without progress',
+            type=positive_int, default=600)
+    parser.add_argument('--wait', help='with --connect, seconds to wait for the daemon to reply',
+            type=positive_int, default=3600)
     parser.add_argument('-tusers',  '--tousers', help='to these accounts')
     parser.add_argument('-u',  '--until', help='until date yyyy-mm-dd[-HH:MM]')
 
@@ -538,6 +746,15 @@ def read_args():
 
 def main():
     args = read_args()
+    if args.serve:
+        serve(args.socket, args.timeout)
+        return
+    if args.connect:
+        # the daemon checks the payload, keeping the strict since/until
+        payload = read_payload(args, check=False)
+        for tweet in submit(args.socket, payload, args.raw, args.key, args.wait):
+            print('{}'.format(json.dumps(tweet)))
+        return
     payload = read_payload(args)
     if args.raw:
         keys = name2keys(args.key)
@@ -0,0 +1,98 @@
+"""Measures the start-up cost of advancedsearch.py.
+
+Each sample runs in a fresh interpreter, which is what a scheduler pays
+per invocation, and reports which heavy dependencies were pulled in.
+Modes:
+  import  bare import of the module
+  scrape  import, AdvancedSearchWrapper() and a first parse (default run)
+  raw     scrape plus credentials and a REST_API session (--raw run)
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+APP_DATA = os.path.dirname(os.path.abspath(__file__))
+
+HEAVY = ('requests', 'bs4', 'requests_oauthlib')
+
+MODES = {
+    'import': '',
+    'scrape': 'advancedsearch.AdvancedSearchWrapper().parse_result("")',
+    'raw': 'advancedsearch.AdvancedSearchWrapper().parse_result("")\n'
+           'advancedsearch.REST_API(keys=advancedsearch.name2keys(),'
+           ' end_point="status_lookup")',
+}
+
+PROBE = '''
+import sys, json, time
+t = time.perf_counter()
+import advancedsearch
+%s
+t = time.perf_counter() - t
+print(json.dumps({'seconds': t,
+                  'loaded': [m for m in %r if m in sys.modules]}))
+'''
+
+
+def measure(mode, n=20, cwd=APP_DATA):
+    """runs mode n times, each in a new interpreter started in cwd"""
+    probe = PROBE % (MODES[mode], HEAVY)
+    samples = []
+    loaded = set()
+    for _ in range(n):
+        out = subprocess.check_output([sys.executable, '-c', probe], cwd=cwd)
+        result = json.loads(out.decode('utf-8'))
+        samples.append(result['seconds'])
+        loaded.update(result['loaded'])
+    return samples, sorted(loaded)
+
+
+def checkout(rev, dest):
+    """writes advancedsearch.py and credentials.cfg at git revision rev into dest"""
+    for fin in ('advancedsearch.py', 'credentials.cfg'):
+        content = subprocess.check_output(['git', 'show', '{}:{}'.format(rev, fin)],
+                cwd=APP_DATA)
+        with open(os.path.join(dest, fin), 'wb') as f:
+            f.write(content)
+
+
+def report(label, samples, loaded):
+    print('{:<16} median {:7.2f} ms  min {:7.2f} ms  max {:7.2f} ms  loaded: {}'.format(
+        label,
+        statistics.median(samples) * 1000,
+        min(samples) * 1000,
+        max(samples) * 1000,
+        ', '.join(loaded) or 'none'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='advancedsearch start-up benchmark.')
+    parser.add_argument('-n', '--runs', help='number of fresh interpreters per mode',
+            type=int, default=20)
+    parser.add_argument('-m', '--mode', help='what a run does after the import',
+            choices=sorted(MODES), action='append')
+    parser.add_argument('-b', '--baseline', help='git revision to compare against, e.g. HEAD~1')
+    args = parser.parse_args()
+    modes = args.mode or ['import', 'scrape', 'raw']
+    baseline = None
+    if args.baseline:
+        baseline = tempfile.mkdtemp()
+        checkout(args.baseline, baseline)
+    try:
+        for mode in modes:
+            report(mode, *measure(mode, args.runs))
+            if baseline:
+                report('{} ({})'.format(mode, args.baseline),
+                        *measure(mode, args.runs, cwd=baseline))
+    finally:
+        if baseline:
+            shutil.rmtree(baseline)
+
+
+if __name__ == '__main__':
+    main()
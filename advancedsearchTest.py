@@ -1,7 +1,18 @@
+import os
+import sys
+import argparse
+import shutil
+import time
+import tempfile
 import unittest
+import subprocess
+from threading import Event, Thread
+from unittest import mock
 from datetime import datetime, timezone
 
+import advancedsearch
 from advancedsearch import name2keys, AdvancedSearch, AdvancedSearchWrapper
+from advancedsearch import check_payload, make_server, submit, positive_int
 
 TWITTER_DATE_FORMAT = '%a %b %d %H:%M:%S %z %Y'
 
@@ -100,5 +111,184 @@ class TestAdvancedSearchWrapper(unittest.TestCase):
             self.assertTrue(screen_name in ('hillaryclinton', 'realdonaldtrump'))
 
 
+class TestStartup(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        """importing the module does not load the heavy dependencies"""
+        probe = ('import sys, advancedsearch\n'
+                 'print(" ".join(m for m in ("requests", "bs4", "requests_oauthlib")'
+                 ' if m in sys.modules))')
+        out = subprocess.check_output([sys.executable, '-c', probe],
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(out.decode('utf-8').strip(), '')
+
+    def test_check_payload_resets_strict_dates(self):
+        check_payload({'since': '2016-12-19 20:00:00',
+                       'until': '2016-12-19 23:59:59'})
+        self.assertIsNotNone(advancedsearch.STRICTLY_SINCE)
+        self.assertIsNotNone(advancedsearch.STRICTLY_UNTIL)
+        check_payload({'hashtags': 'kdd2016'})
+        self.assertIsNone(advancedsearch.STRICTLY_SINCE)
+        self.assertIsNone(advancedsearch.STRICTLY_UNTIL)
+
+    def test_positive_int(self):
+        self.assertEqual(positive_int('3'), 3)
+        for value in ('0', '-5'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                positive_int(value)
+
+
+KEYS = {'client_key': 'a', 'client_secret': 'b',
+        'resource_owner_key': 'c', 'resource_owner_secret': 'd'}
+
+RAW_TWEET = {'id_str': '1', 'created_at': 'Wed Aug 10 10:00:00 +0000 2016'}
+
+
+def fake_search(self, payload):
+    yield {'tweet_id': '1', 'hashtags': payload.get('hashtags')}
+
+
+def failing_search(self, payload):
+    raise ValueError('search failed')
+    yield
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.address = os.path.join(self.tmp, 'test.sock')
+        self.patches = [
+            mock.patch.object(advancedsearch, 'name2keys', return_value=KEYS),
+            mock.patch.object(advancedsearch.REST_API, 'post',
+                return_value=[RAW_TWEET])]
+        for p in self.patches:
+            p.start()
+        self.server = make_server(self.address, timeout=1)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_search(self):
+        with mock.patch.object(AdvancedSearchWrapper, 'run', fake_search):
+            tweets = list(submit(self.address, {'hashtags': 'kdd2016'}))
+        self.assertEqual(tweets, [{'tweet_id': '1', 'hashtags': 'kdd2016'}])
+
+    def test_raw_search(self):
+        with mock.patch.object(AdvancedSearchWrapper, 'run', fake_search):
+            tweets = list(submit(self.address, {'hashtags': 'kdd2016'}, raw=True))
+        self.assertEqual(tweets, [RAW_TWEET])
+
+    def test_tweet_with_error_field(self):
+        """tweets are not mistaken for error messages"""
+        def search(self, payload):
+            yield {'tweet_id': '1', 'error': 'not an error'}
+        with mock.patch.object(AdvancedSearchWrapper, 'run', search):
+            tweets = list(submit(self.address, {}))
+        self.assertEqual(tweets, [{'tweet_id': '1', 'error': 'not an error'}])
+
+    def test_error(self):
+        with mock.patch.object(AdvancedSearchWrapper, 'run', failing_search):
+            with self.assertRaisesRegex(RuntimeError, 'search failed'):
+                list(submit(self.address, {}))
+        with mock.patch.object(AdvancedSearchWrapper, 'run', fake_search):
+            self.assertEqual(len(list(submit(self.address, {}))), 1)
+
+    def test_raw_error(self):
+        """a failing raw job reports the error and does not block later jobs"""
+        with mock.patch.object(AdvancedSearchWrapper, 'run', failing_search):
+            with self.assertRaisesRegex(RuntimeError, 'search failed'):
+                list(submit(self.address, {}, raw=True))
+        with mock.patch.object(AdvancedSearchWrapper, 'run', fake_search):
+            self.assertEqual(list(submit(self.address, {}, raw=True)), [RAW_TWEET])
+
+    def test_raw_timeout_drops_session(self):
+        """a raw job stuck in the lookup does not share its session with later jobs"""
+        release = Event()
+        sessions = []
+        def stuck_post(self, payload):
+            sessions.append(self.session)
+            if len(sessions) == 1:
+                release.wait()
+            return [RAW_TWEET]
+        try:
+            with mock.patch.object(AdvancedSearchWrapper, 'run', fake_search), \
+                    mock.patch.object(advancedsearch.REST_API, 'post', stuck_post):
+                with self.assertRaisesRegex(RuntimeError, 'no progress within'):
+                    list(submit(self.address, {}, raw=True))
+                self.assertEqual(list(submit(self.address, {}, raw=True)), [RAW_TWEET])
+        finally:
+            release.set()
+        self.assertIsNot(sessions[0], sessions[1])
+
+    def test_timeout(self):
+        """a stuck job is aborted and does not block later jobs"""
+        release = Event()
+        def stuck_search(self, payload):
+            release.wait()
+            yield {'tweet_id': '1'}
+        try:
+            with mock.patch.object(AdvancedSearchWrapper, 'run', stuck_search):
+                with self.assertRaisesRegex(RuntimeError, 'no progress within'):
+                    list(submit(self.address, {}))
+            with mock.patch.object(AdvancedSearchWrapper, 'run', fake_search):
+                self.assertEqual(len(list(submit(self.address, {}))), 1)
+        finally:
+            release.set()
+
+    def test_progress_without_tweets(self):
+        """a job that keeps fetching pages is not aborted"""
+        def paging_search(self, payload):
+            self.url = 'https://twitter.com/search'
+            for _ in range(4):
+                time.sleep(0.5)
+                self.fetch(payload)
+            yield {'tweet_id': '1'}
+        with mock.patch('requests.Session.get'):
+            with mock.patch.object(AdvancedSearchWrapper, 'run', paging_search):
+                self.assertEqual(list(submit(self.address, {})), [{'tweet_id': '1'}])
+
+    def test_submit_timeout(self):
+        """a client waiting behind a stuck job gives up"""
+        release = Event()
+        def stuck_search(self, payload):
+            release.wait()
+            yield {'tweet_id': '1'}
+        def first_job():
+            with self.assertRaises(RuntimeError):
+                list(submit(self.address, {}, timeout=5))
+        first = Thread(target=first_job)
+        with mock.patch.object(AdvancedSearchWrapper, 'run', stuck_search):
+            first.start()
+            time.sleep(0.2)
+            try:
+                with self.assertRaisesRegex(TimeoutError, 'no reply from daemon'):
+                    list(submit(self.address, {}, timeout=0.3))
+            finally:
+                first.join()
+                release.set()
+            # the abandoned job is still queued; wait for it while stubbed
+            self.assertEqual(len(list(submit(self.address, {}))), 1)
+
+    def test_socket_permissions(self):
+        self.assertEqual(os.stat(self.address).st_mode & 0o777, 0o600)
+
+    def test_refuses_running_daemon(self):
+        with self.assertRaises(FileExistsError):
+            make_server(self.address)
+
+    def test_refuses_non_socket(self):
+        fin = os.path.join(self.tmp, 'search.txt')
+        open(fin, 'w').close()
+        with self.assertRaises(FileExistsError):
+            make_server(fin)
+        self.assertTrue(os.path.exists(fin))
+
+
 if __name__ == '__main__':
     unittest.main()